@@ -1,32 +1,23 @@
 from flask import Flask, jsonify, request
-import blpapi
-import os
 
-SESSION_OPTIONS = blpapi.SessionOptions()
-SESSION_OPTIONS.setServerHost(os.environ.get('BLPAPI_SERVER_HOST', 'localhost'))
-SESSION_OPTIONS.setServerPort(int(os.environ.get('BLPAPI_SERVER_PORT', 8194)))
+from gateway.coalesce import RequestCoalescer
+from gateway.session import BloombergSession, RequestFailed, RequestTimeout, SessionDown
 
 app = Flask(__name__)
 
+# プロセス内で共有する Bloomberg セッション (起動時に接続し、以後使い回す)
+BBG_SESSION = BloombergSession()
+
 def get_reference_data(tickers, fields):
-    session = blpapi.Session(SESSION_OPTIONS)
+    # 同時に届いた問い合わせは COALESCER がまとめて _fetch_reference_data に渡す
+    return COALESCER.submit(tickers, fields)
+
+def _fetch_reference_data(tickers, fields):
     data = []
     error_message = None
 
     try:
-        if not session.start():
-            error_message = "Failed to start Bloomberg session."
-            print(error_message)
-            return None, error_message
-
-        if not session.openService("//blp/refdata"):
-            error_message = "Failed to open //blp/refdata service."
-            print(error_message)
-            session.stop()
-            return None, error_message
-
-        service = session.getService("//blp/refdata")
-        request = service.createRequest("ReferenceDataRequest")
+        request = BBG_SESSION.create_request("ReferenceDataRequest")
 
         for ticker in tickers:
             request.append("securities", ticker)
@@ -34,74 +25,67 @@ def get_reference_data(tickers, fields):
             request.append("fields", field)
 
         print(f"Sending request: securities={tickers}, fields={fields}")
-        session.sendRequest(request)
-
-        done = False
-        while not done:
-            ev = session.nextEvent(5000)
-            if ev.eventType() == blpapi.Event.TIMEOUT:
-                error_message = "Bloomberg API request timed out."
+        # 他スレッドのリクエストと同じセッションを共有し、CorrelationId で応答を受け取る
+        pending = BBG_SESSION.send(request)
+
+        for msg in pending.messages(timeout=5.0):
+            print(f"Bloomberg Message: {msg}")
+            if msg.hasElement("responseError"):
+                response_error = msg.getElement("responseError")
+                error_message = f"Response Error: {response_error.getElementAsString('message')}"
                 print(error_message)
                 break
 
-            for msg in ev:
-                print(f"Bloomberg Message: {msg}")
-                if msg.hasElement("responseError"):
-                    response_error = msg.getElement("responseError")
-                    error_message = f"Response Error: {response_error.getElementAsString('message')}"
-                    print(error_message)
-                    done = True
-                    break
-
-                if msg.hasElement("securityData"):
-                    security_data_array = msg.getElement("securityData")
-                    for i in range(security_data_array.numValues()):
-                        security_data = security_data_array.getValueAsElement(i)
-                        sec_name = security_data.getElementAsString("security")
-                        row = {"security": sec_name}
-
-                        # fieldExceptions
-                        if security_data.hasElement("fieldExceptions", True) and \
-                           security_data.getElement("fieldExceptions").numValues() > 0:
-                            field_exceptions_array = security_data.getElement("fieldExceptions")
-                            for k in range(field_exceptions_array.numValues()):
-                                field_exception = field_exceptions_array.getValueAsElement(k)
-                                error_info = field_exception.getElement("errorInfo")
-                                field_id = field_exception.getElementAsString('fieldId')
-                                error_msg = error_info.getElementAsString('message')
-                                row[field_id] = f"Field Error: {error_msg}"
-
-                        # securityError
-                        if security_data.hasElement("securityError"):
-                            security_error = security_data.getElement("securityError")
-                            error_msg = security_error.getElementAsString('message')
-                            row["securityError"] = f"Security Error: {error_msg}"
-
-                        # fieldData
-                        field_data = security_data.getElement("fieldData")
-                        for field in fields:
-                            # 常にrowにキーが存在するようにNoneで初期化
-                            row[field] = None
-                            if field_data.hasElement(field):
+            if msg.hasElement("securityData"):
+                security_data_array = msg.getElement("securityData")
+                for i in range(security_data_array.numValues()):
+                    security_data = security_data_array.getValueAsElement(i)
+                    sec_name = security_data.getElementAsString("security")
+                    row = {"security": sec_name}
+
+                    # fieldExceptions
+                    if security_data.hasElement("fieldExceptions", True) and \
+                       security_data.getElement("fieldExceptions").numValues() > 0:
+                        field_exceptions_array = security_data.getElement("fieldExceptions")
+                        for k in range(field_exceptions_array.numValues()):
+                            field_exception = field_exceptions_array.getValueAsElement(k)
+                            error_info = field_exception.getElement("errorInfo")
+                            field_id = field_exception.getElementAsString('fieldId')
+                            error_msg = error_info.getElementAsString('message')
+                            row[field_id] = f"Field Error: {error_msg}"
+
+                    # securityError
+                    if security_data.hasElement("securityError"):
+                        security_error = security_data.getElement("securityError")
+                        error_msg = security_error.getElementAsString('message')
+                        row["securityError"] = f"Security Error: {error_msg}"
+
+                    # fieldData
+                    field_data = security_data.getElement("fieldData")
+                    for field in fields:
+                        # 常にrowにキーが存在するようにNoneで初期化
+                        row[field] = None
+                        if field_data.hasElement(field):
+                            try:
+                                row[field] = field_data.getElementAsFloat(field)
+                            except Exception:
                                 try:
-                                    row[field] = field_data.getElementAsFloat(field)
+                                    row[field] = field_data.getElementAsString(field)
                                 except Exception:
-                                    try:
-                                        row[field] = field_data.getElementAsString(field)
-                                    except Exception:
-                                        pass # Noneのまま
-                        data.append(row)
-                done = ev.eventType() == blpapi.Event.RESPONSE
+                                    pass # Noneのまま
+                    data.append(row)
 
+    except (SessionDown, RequestTimeout, RequestFailed) as e:
+        error_message = str(e)
+        print(error_message)
     except Exception as e:
         error_message = f"Exception while getting data: {str(e)}"
         print(error_message)
-    finally:
-        if session:
-            session.stop()
 
     return data, error_message
 
+COALESCER = RequestCoalescer(_fetch_reference_data)
+
 @app.route('/api/reference_data', methods=['GET'])
 def reference_data_api():
     """
@@ -147,5 +131,7 @@ def reference_data_api():
         return jsonify({"error": error_msg_to_return}), 500
 
 if __name__ == '__main__':
+    # リクエストごとではなくプロセス起動時に一度だけ接続しておく
+    BBG_SESSION.start()
     # Flaskのデフォルトは'127.0.0.1'なので、外部からアクセスできるように'0.0.0.0'を指定
     app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
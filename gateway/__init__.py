@@ -0,0 +1,3 @@
+"""
+blpapi.py (Flask ゲートウェイ) から利用する Bloomberg 接続まわりの部品。
+"""
@@ -0,0 +1,106 @@
+"""
+同時に届いた参照データの問い合わせを 1 本の ReferenceDataRequest にまとめる。
+
+寄り付き直後は多数のタブが 1 銘柄ずつ /api/fetch-market-price を叩くため、
+短い待ち時間 (数ミリ秒) の間に届いた問い合わせの銘柄・フィールドを合算して
+Bloomberg へは 1 回だけ問い合わせ、securityData の行を各呼び出し元へ配り直す。
+同じ内容の問い合わせが処理中なら、その結果をそのまま共有する (singleflight)。
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+# まとめる待ち時間 (ミリ秒)。0 なら合算せず singleflight のみ行う
+COALESCE_WINDOW_MS = float(os.environ.get('BBG_COALESCE_WINDOW_MS', 5))
+# 1 回にまとめる銘柄数の上限。超えたら待ち時間の途中でも送信する
+COALESCE_MAX_SECURITIES = int(os.environ.get('BBG_COALESCE_MAX_SECURITIES', 200))
+
+
+class _Batch:
+    def __init__(self):
+        self.entries = {}  # (tickers, fields) -> Future
+        self.securities = {}  # 挿入順を保つ dict を順序付き集合として使う
+        self.fields = {}
+        self.full = threading.Event()
+
+    def add(self, key, future):
+        tickers, fields = key
+        self.entries[key] = future
+        self.securities.update(dict.fromkeys(tickers))
+        self.fields.update(dict.fromkeys(fields))
+
+
+def _rows_for(key, rows_by_security):
+    """合算した結果から、1 件の問い合わせ分の行を取り出す。"""
+    tickers, fields = key
+    rows = []
+    for ticker in tickers:
+        merged = rows_by_security.get(ticker)
+        if merged is None:
+            continue
+        row = {"security": merged["security"]}
+        if "securityError" in merged:
+            row["securityError"] = merged["securityError"]
+        for field in fields:
+            row[field] = merged.get(field)
+        rows.append(row)
+    return rows
+
+
+class RequestCoalescer:
+    """
+    fetch(tickers, fields) -> (rows, error) の前段に置き、同時に届いた
+    問い合わせを合算・共有する。
+    """
+
+    def __init__(self, fetch, window_ms=COALESCE_WINDOW_MS, max_securities=COALESCE_MAX_SECURITIES):
+        self._fetch = fetch
+        self._window = window_ms / 1000.0
+        self._max_securities = max_securities
+        self._lock = threading.Lock()
+        self._batch = None
+        self._inflight = {}  # (tickers, fields) -> Future (送信待ち・送信済み)
+
+    def submit(self, tickers, fields):
+        key = (tuple(tickers), tuple(fields))
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                # 同じ問い合わせが処理中なのでその結果を待つ
+                return future.result()
+
+            future = Future()
+            self._inflight[key] = future
+            leader = self._batch is None
+            if leader:
+                self._batch = _Batch()
+            batch = self._batch
+            batch.add(key, future)
+            if len(batch.securities) >= self._max_securities:
+                # 上限に達したら締め切り、以降の問い合わせは次のまとまりへ
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            # 最初に来た呼び出し元が待ち時間の後にまとめて送信する
+            if self._window > 0:
+                batch.full.wait(self._window)
+            self._flush(batch)
+        return future.result()
+
+    def _flush(self, batch):
+        with self._lock:
+            if self._batch is batch:
+                self._batch = None
+
+        try:
+            rows, error = self._fetch(list(batch.securities), list(batch.fields))
+        except Exception as e:
+            rows, error = None, f"Exception while getting data: {str(e)}"
+
+        rows_by_security = {row["security"]: row for row in rows or []}
+        with self._lock:
+            for key in batch.entries:
+                self._inflight.pop(key, None)
+        for key, future in batch.entries.items():
+            future.set_result((_rows_for(key, rows_by_security), error))
@@ -0,0 +1,268 @@
+"""
+ゲートウェイプロセス全体で共有する長寿命の Bloomberg セッション。
+
+リクエストごとに Session.start() / openService() を行うとハンドシェイクの
+コストが ReferenceDataRequest 本体より大きくなるため、プロセス起動時に一度だけ
+接続し、SessionConnectionDown / ServiceDown を受け取ったら自動で再接続する。
+
+セッションは非同期モード (イベントハンドラ付き) で開き、ハンドラスレッドが
+受け取ったメッセージを CorrelationId ごとに待っている呼び出し元へ振り分ける。
+これにより Flask の複数スレッドが 1 本の接続上で同時にリクエストを流せる。
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+
+import blpapi
+
+REFDATA_SERVICE = "//blp/refdata"
+
+# 再接続が必要になる管理メッセージ
+_DOWN_MESSAGES = {
+    "SessionConnectionDown",
+    "SessionTerminated",
+    "SessionStartupFailure",
+    "ServiceDown",
+}
+
+# 再接続を連続で試みる際の最小間隔 (秒)
+RECONNECT_BACKOFF = float(os.environ.get('BLPAPI_RECONNECT_BACKOFF', 2.0))
+
+
+class SessionDown(Exception):
+    """セッションが使えない、または応答待ちの間に接続が切れた。"""
+
+
+class RequestTimeout(Exception):
+    """応答待ちのイベントが時間内に届かなかった。"""
+
+
+class RequestFailed(Exception):
+    """REQUEST_STATUS (RequestFailure) でリクエストが打ち切られた。"""
+
+
+def build_session_options():
+    options = blpapi.SessionOptions()
+    options.setServerHost(os.environ.get('BLPAPI_SERVER_HOST', 'localhost'))
+    options.setServerPort(int(os.environ.get('BLPAPI_SERVER_PORT', 8194)))
+    return options
+
+
+class PendingRequest:
+    """
+    送信済みリクエスト 1 件分の受け口。
+
+    イベントハンドラスレッドが deliver() でメッセージを積み、呼び出し元の
+    スレッドが messages() で取り出す。最終 RESPONSE を受け取ると終了する。
+    """
+
+    _FINAL = object()
+
+    def __init__(self, correlation_id, on_close=None):
+        self.correlation_id = correlation_id
+        self._queue = queue.Queue()
+        self._on_close = on_close
+        self.finished = False
+
+    def deliver(self, event, msg, final):
+        # msg は event に属するので、取り出されるまで event ごと保持しておく
+        self._queue.put((event, msg))
+        if final:
+            self._queue.put((None, self._FINAL))
+
+    def fail(self, error):
+        self._queue.put((None, error))
+
+    def messages(self, timeout=5.0):
+        """
+        届いたメッセージを順に返す。timeout 秒以上何も届かなければ
+        RequestTimeout、接続断なら SessionDown を送出する。
+        """
+        try:
+            while True:
+                try:
+                    _, item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    raise RequestTimeout("Bloomberg API request timed out.")
+                if item is self._FINAL:
+                    self.finished = True
+                    return
+                if isinstance(item, Exception):
+                    self.finished = True
+                    raise item
+                yield item
+        finally:
+            # 途中で読むのをやめた場合も振り分け先の登録を外す
+            if not self.finished and self._on_close is not None:
+                self._on_close(self.correlation_id.value())
+
+
+class BloombergSession:
+    """
+    1 プロセスにつき 1 本の Bloomberg セッションを保持し、
+    CorrelationId でリクエストと応答を対応付ける。
+    """
+
+    def __init__(self, options=None, services=(REFDATA_SERVICE,)):
+        self._options = options or build_session_options()
+        self._services = tuple(services)
+        self._session = None
+        self._lock = threading.RLock()
+        self._last_attempt = 0.0
+        self._reconnecting = False
+        self._closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self.last_error = None
+
+    @property
+    def connected(self):
+        return self._session is not None
+
+    def start(self):
+        """セッションを開始してサービスを開く。成功したら True。"""
+        with self._lock:
+            if self._session is not None:
+                return True
+            self._closed = False
+            self._last_attempt = time.monotonic()
+            session = blpapi.Session(self._options, self._handle_event)
+            if not session.start():
+                self.last_error = "Failed to start Bloomberg session."
+                print(self.last_error)
+                return False
+            for service in self._services:
+                if not session.openService(service):
+                    self.last_error = f"Failed to open {service} service."
+                    print(self.last_error)
+                    session.stop()
+                    return False
+            self._session = session
+            self.last_error = None
+            print(f"Bloomberg session started: services={list(self._services)}")
+            return True
+
+    def stop(self):
+        with self._lock:
+            self._closed = True
+            session, self._session = self._session, None
+        self._fail_all(SessionDown("Bloomberg session stopped."))
+        if session is not None:
+            try:
+                session.stop()
+            except Exception as e:
+                print(f"Exception while stopping Bloomberg session: {e}")
+
+    def _ensure_started(self):
+        if self._session is not None:
+            return True
+        with self._lock:
+            # 直前の失敗から間がなければ Bloomberg への接続を連打しない
+            wait = RECONNECT_BACKOFF - (time.monotonic() - self._last_attempt)
+            if wait > 0:
+                time.sleep(wait)
+            return self.start()
+
+    def get_service(self, name=REFDATA_SERVICE):
+        if not self._ensure_started():
+            raise SessionDown(self.last_error or "Failed to start Bloomberg session.")
+        return self._session.getService(name)
+
+    def create_request(self, operation, service=REFDATA_SERVICE):
+        return self.get_service(service).createRequest(operation)
+
+    def send(self, request):
+        """
+        リクエストに固有の CorrelationId を付けて送信し、応答の受け口を返す。
+        """
+        if not self._ensure_started():
+            raise SessionDown(self.last_error or "Failed to start Bloomberg session.")
+        cid = blpapi.CorrelationId(next(self._ids))
+        pending = PendingRequest(cid, on_close=self._forget)
+        with self._pending_lock:
+            self._pending[cid.value()] = pending
+        try:
+            self._session.sendRequest(request, correlationId=cid)
+        except Exception:
+            self._forget(cid.value())
+            raise
+        return pending
+
+    def _forget(self, key):
+        with self._pending_lock:
+            return self._pending.pop(key, None)
+
+    def _fail_all(self, error):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for p in pending.values():
+            p.fail(error)
+
+    # --- イベントハンドラスレッド側 -------------------------------------
+
+    def _handle_event(self, event, session):
+        try:
+            event_type = event.eventType()
+            if event_type in (blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE,
+                              blpapi.Event.REQUEST_STATUS):
+                self._route(event, event_type)
+            elif event_type in (blpapi.Event.SESSION_STATUS, blpapi.Event.SERVICE_STATUS):
+                for msg in event:
+                    self._handle_admin_message(msg, session)
+        except Exception as e:
+            # ハンドラから例外を投げるとイベント配送が止まるので握りつぶす
+            print(f"Exception in Bloomberg event handler: {e}")
+
+    def _route(self, event, event_type):
+        final = event_type != blpapi.Event.PARTIAL_RESPONSE
+        for msg in event:
+            for cid in msg.correlationIds():
+                key = cid.value()
+                if final:
+                    pending = self._forget(key)
+                else:
+                    with self._pending_lock:
+                        pending = self._pending.get(key)
+                if pending is None:
+                    continue
+                if event_type == blpapi.Event.REQUEST_STATUS:
+                    # RequestFailure などはその応答の最後としてエラーにする
+                    pending.fail(RequestFailed(f"Request failed: {msg}"))
+                else:
+                    pending.deliver(event, msg, final)
+
+    def _handle_admin_message(self, msg, session):
+        msg_type = str(msg.messageType())
+        if msg_type not in _DOWN_MESSAGES:
+            return
+        print(f"Bloomberg session down: {msg_type}")
+        with self._lock:
+            if self._session is not session:
+                return
+            self._session = None
+            self.last_error = f"Bloomberg session down: {msg_type}"
+        self._fail_all(SessionDown(self.last_error))
+        # ハンドラスレッドから stop() を呼ぶとデッドロックするので非同期で止める
+        try:
+            session.stopAsync()
+        except Exception:
+            pass
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        with self._lock:
+            if self._reconnecting or self._closed:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect_loop, name="blpapi-reconnect",
+                         daemon=True).start()
+
+    def _reconnect_loop(self):
+        try:
+            while not self._closed and not self._ensure_started():
+                pass
+        finally:
+            self._reconnecting = False